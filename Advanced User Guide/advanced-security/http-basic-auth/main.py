@@ -1,22 +1,109 @@
+import hashlib
+import hmac
 import secrets
-from fastapi import Depends, FastAPI, HTTPException, status
+import threading
+import time
+from collections import OrderedDict
+from fastapi import Depends, FastAPI, HTTPException, Request, status
 from fastapi.security import HTTPBasic, HTTPBasicCredentials
 
 app = FastAPI()
 
 security = HTTPBasic()
 
-def get_current_username(credentials: HTTPBasicCredentials = Depends(security)):
-    correct_username = secrets.compare_digest(credentials.username, "stanleyjobson")
-    correct_password = secrets.compare_digest(credentials.password, "swordfish")
-    if not (correct_username and correct_password):
+# Successful checks are remembered this long, keyed by a keyed digest rather than the password itself
+CREDENTIAL_CACHE_TTL = 60
+CREDENTIAL_CACHE_SIZE = 10000
+# Each client may fail FAILURE_BURST times, then regains one attempt every FAILURE_REFILL_SECONDS
+FAILURE_BURST = 10
+FAILURE_REFILL_SECONDS = 6
+FAILURE_CLIENTS_TRACKED = 100000
+
+class CredentialBackend:
+    def verify(self, username: str, password: str) -> bool:
+        raise NotImplementedError
+
+class StaticCredentialBackend(CredentialBackend):
+    def __init__(self, users: dict):
+        self.users = users
+    def verify(self, username: str, password: str) -> bool:
+        expected_password = self.users.get(username)
+        # Compare even for unknown users so the timing doesn't reveal which usernames exist
+        correct_password = secrets.compare_digest(password.encode(), (expected_password or "").encode())
+        return expected_password is not None and correct_password
+
+class VerifiedCredentialCache:
+    def __init__(self, ttl: float, maxsize: int):
+        self.ttl = ttl
+        self.maxsize = maxsize
+        self.key = secrets.token_bytes(32)
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+    def digest(self, username: str, password: str) -> bytes:
+        return hmac.new(self.key, f"{username}\0{password}".encode(), hashlib.sha256).digest()
+    def contains(self, digest: bytes) -> bool:
+        with self.lock:
+            expires = self.entries.get(digest)
+            if expires is None:
+                return False
+            if expires < time.monotonic():
+                del self.entries[digest]
+                return False
+            return True
+    def add(self, digest: bytes):
+        with self.lock:
+            self.entries[digest] = time.monotonic() + self.ttl
+            self.entries.move_to_end(digest)
+            if len(self.entries) > self.maxsize:
+                self.entries.popitem(last=False)
+
+class FailureLimiter:
+    # Token bucket per client that only failed attempts drain
+    def __init__(self, burst: int, refill_seconds: float, maxsize: int):
+        self.burst = burst
+        self.refill_seconds = refill_seconds
+        self.maxsize = maxsize
+        self.buckets = OrderedDict()
+        self.lock = threading.Lock()
+    def _tokens(self, client: str, now: float) -> float:
+        tokens, updated = self.buckets.get(client, (self.burst, now))
+        return min(self.burst, tokens + (now - updated) / self.refill_seconds)
+    def allowed(self, client: str) -> bool:
+        with self.lock:
+            return self._tokens(client, time.monotonic()) >= 1
+    def record_failure(self, client: str):
+        now = time.monotonic()
+        with self.lock:
+            self.buckets[client] = (self._tokens(client, now) - 1, now)
+            self.buckets.move_to_end(client)
+            if len(self.buckets) > self.maxsize:
+                self.buckets.popitem(last=False)
+
+credential_backend: CredentialBackend = StaticCredentialBackend({"stanleyjobson": "swordfish"})
+credential_cache = VerifiedCredentialCache(CREDENTIAL_CACHE_TTL, CREDENTIAL_CACHE_SIZE)
+failure_limiter = FailureLimiter(FAILURE_BURST, FAILURE_REFILL_SECONDS, FAILURE_CLIENTS_TRACKED)
+
+def get_current_username(request: Request, credentials: HTTPBasicCredentials = Depends(security)):
+    client = request.client.host if request.client else "unknown"
+    if not failure_limiter.allowed(client):
+        raise HTTPException(
+            status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+            detail="Too many failed attempts",
+            headers={"Retry-After": str(FAILURE_REFILL_SECONDS)},
+        )
+    digest = credential_cache.digest(credentials.username, credentials.password)
+    if credential_cache.contains(digest):
+        return credentials.username
+    if not credential_backend.verify(credentials.username, credentials.password):
+        failure_limiter.record_failure(client)
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Incorrect email or password",
             headers={"WWW-Authenticate": "Basic"},
         )
+    credential_cache.add(digest)
     return credentials.username
 
 @app.get("/users/me")
 def read_current_user(username: str = Depends(get_current_username)):
-    return {"username": username}
\ No newline at end of file
+    return {"username": username}
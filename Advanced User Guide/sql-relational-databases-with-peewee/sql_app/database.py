@@ -1,7 +1,12 @@
 from contextvars import ContextVar
+import time
 import peewee
+from playhouse.pool import PooledSqliteDatabase
 
 DATABASE_NAME = "test.db"
+MAX_CONNECTIONS = 20
+STALE_TIMEOUT = 300  # seconds an idle connection may sit in the pool
+POOL_TIMEOUT = 10  # seconds to wait for a free connection before failing
 
 db_state_default = {"closed": None, "conn": None, "ctx": None, "transactions": None}
 db_state = ContextVar("db_state", default=db_state_default.copy())
@@ -15,6 +20,41 @@ class PeeweeConnectionState(peewee._ConnectionState):
     def __getattr__(self, name):
         return self._state.get()[name]
 
-db = peewee.SqliteDatabase(DATABASE_NAME, check_same_thread=False)
+class CountingSqliteDatabase(peewee.SqliteDatabase):
+    # Sits below the pool in the MRO, so this only runs when a brand new connection is opened
+    def _connect(self):
+        self.pool_stats["opened"] += 1
+        return super()._connect()
+
+class InstrumentedPooledSqliteDatabase(PooledSqliteDatabase, CountingSqliteDatabase):
+    def __init__(self, *args, **kwargs):
+        self.pool_stats = {"checkouts": 0, "opened": 0, "checkout_wait": 0.0, "max_checkout_wait": 0.0}
+        super().__init__(*args, **kwargs)
+    def connect(self, reuse_if_open=False):
+        start = time.perf_counter()
+        result = super().connect(reuse_if_open)
+        waited = time.perf_counter() - start
+        with self._pool_lock:
+            self.pool_stats["checkouts"] += 1
+            self.pool_stats["checkout_wait"] += waited
+            self.pool_stats["max_checkout_wait"] = max(self.pool_stats["max_checkout_wait"], waited)
+        return result
+    def stats(self):
+        with self._pool_lock:
+            return dict(
+                self.pool_stats,
+                in_use=len(self._in_use),
+                idle=len(self._connections),
+                max_connections=self._max_connections,
+            )
+
+# connect()/close() in get_db now check a connection out of / back into the pool
+db = InstrumentedPooledSqliteDatabase(
+    DATABASE_NAME,
+    max_connections=MAX_CONNECTIONS,
+    stale_timeout=STALE_TIMEOUT,
+    timeout=POOL_TIMEOUT,
+    check_same_thread=False,
+)
 
 db._state = PeeweeConnectionState()
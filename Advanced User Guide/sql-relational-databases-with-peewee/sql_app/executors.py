@@ -0,0 +1,107 @@
+import asyncio
+import contextvars
+import functools
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from anyio import to_thread
+
+class MeteredExecutor:
+    # A dedicated thread pool for known-slow work, so it queues here instead of in the shared anyio pool
+    def __init__(self, max_workers: int, name: str):
+        self.max_workers = max_workers
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix=name)
+        self._lock = threading.Lock()
+        self.submitted = 0
+        self.started = 0
+        self.completed = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+
+    async def run(self, func, *args, **kwargs):
+        enqueued = time.perf_counter()
+        # Carry the request's contextvars (peewee's db_state) over to the worker thread
+        context = contextvars.copy_context()
+
+        def call():
+            waited = time.perf_counter() - enqueued
+            with self._lock:
+                self.started += 1
+                self.wait_total += waited
+                self.wait_max = max(self.wait_max, waited)
+            try:
+                return context.run(func, *args, **kwargs)
+            finally:
+                with self._lock:
+                    self.completed += 1
+
+        with self._lock:
+            self.submitted += 1
+        return await asyncio.get_running_loop().run_in_executor(self.executor, call)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "max_workers": self.max_workers,
+                "queued": self.submitted - self.started,
+                "running": self.started - self.completed,
+                "completed": self.completed,
+                "wait_avg": self.wait_total / self.started if self.started else 0.0,
+                "wait_max": self.wait_max,
+            }
+
+    def shutdown(self):
+        self.executor.shutdown(wait=True)
+
+def offload(executor: MeteredExecutor):
+    # Turns a sync path operation into an async one that runs on `executor`; the signature is kept for FastAPI
+    def decorator(func):
+        @functools.wraps(func)
+        async def wrapper(*args, **kwargs):
+            return await executor.run(func, *args, **kwargs)
+        return wrapper
+    return decorator
+
+class DefaultThreadpool:
+    # The shared anyio pool, used for every other sync route and dependency. run() is metered like
+    # MeteredExecutor.run, so routes wrapped with offload(default_threadpool) record how long they
+    # waited for a token; FastAPI's own calls (sync dependencies) only show up in running/queued
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.started = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+
+    async def run(self, func, *args, **kwargs):
+        enqueued = time.perf_counter()
+
+        def call():
+            waited = time.perf_counter() - enqueued
+            with self._lock:
+                self.started += 1
+                self.wait_total += waited
+                self.wait_max = max(self.wait_max, waited)
+            return func(*args, **kwargs)
+
+        # run_sync copies the request's contextvars to the worker thread itself
+        return await to_thread.run_sync(call)
+
+    def stats(self):
+        limiter = to_thread.current_default_thread_limiter().statistics()
+        with self._lock:
+            return {
+                "max_workers": limiter.total_tokens,
+                "running": limiter.borrowed_tokens,
+                "queued": limiter.tasks_waiting,
+                "wait_avg": self.wait_total / self.started if self.started else 0.0,
+                "wait_max": self.wait_max,
+            }
+
+default_threadpool = DefaultThreadpool()
+
+def set_default_threadpool_size(size: int):
+    # Must be called inside the event loop
+    to_thread.current_default_thread_limiter().total_tokens = size
+
+def default_threadpool_stats():
+    return default_threadpool.stats()
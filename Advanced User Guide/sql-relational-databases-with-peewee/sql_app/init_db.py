@@ -0,0 +1,17 @@
+# Schema setup, run once per deploy with `python -m sql_app.init_db` instead of at import time
+from . import database, models
+
+TABLES = [models.User, models.Item]
+
+def schema_ready() -> bool:
+    with database.db.connection_context():
+        existing = set(database.db.get_tables())
+    return all(model._meta.table_name in existing for model in TABLES)
+
+def init_db():
+    with database.db.connection_context():
+        database.db.create_tables(TABLES)
+
+if __name__ == "__main__":
+    init_db()
+    print("schema ready" if schema_ready() else "schema incomplete")
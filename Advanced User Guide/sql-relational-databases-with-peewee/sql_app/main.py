@@ -1,15 +1,33 @@
 import time
 from typing import List
-from fastapi import Depends, FastAPI, HTTPException
-from . import crud, database, models, schemas
+from fastapi import Depends, FastAPI, HTTPException, Response, status
+from . import crud, database, schemas
 from .database import db_state_default
+from .executors import (
+    MeteredExecutor, default_threadpool, default_threadpool_stats, offload, set_default_threadpool_size,
+)
+from .init_db import init_db, schema_ready
 
-database.db.connect()
-database.db.create_tables([models.User, models.Item])
-database.db.close()
+THREADPOOL_SIZE = 40
+SLOW_POOL_SIZE = 4
 
 app = FastAPI()
 
+slow_executor = MeteredExecutor(SLOW_POOL_SIZE, name="slow-routes")
+
+@app.on_event("startup")
+async def configure_threadpool():
+    set_default_threadpool_size(THREADPOOL_SIZE)
+
+@app.on_event("startup")
+def create_schema():
+    if not schema_ready():
+        init_db()
+
+@app.on_event("shutdown")
+def stop_slow_executor():
+    slow_executor.shutdown()
+
 sleep_time = 10
 
 async def reset_db_state():
@@ -25,6 +43,7 @@ def get_db(db_state=Depends(reset_db_state)):
             database.db.close()
 
 @app.post("/users/", response_model=schemas.User, dependencies=[Depends(get_db)])
+@offload(default_threadpool)
 def create_user(user: schemas.UserCreate):
     db_user = crud.get_user_by_email(email=user.email)
     if db_user:
@@ -32,6 +51,7 @@ def create_user(user: schemas.UserCreate):
     return crud.create_user(user=user)
 
 @app.get("/users/", response_model=List[schemas.User], dependencies=[Depends(get_db)])
+@offload(default_threadpool)
 def read_users(skip: int = 0, limit: int = 100):
     users = crud.get_users(skip=skip, limit=limit)
     return users
@@ -39,6 +59,7 @@ def read_users(skip: int = 0, limit: int = 100):
 @app.get(
     "/users/{user_id}", response_model=schemas.User, dependencies=[Depends(get_db)]
 )
+@offload(default_threadpool)
 def read_user(user_id: int):
     db_user = crud.get_user(user_id=user_id)
     if db_user is None:
@@ -50,20 +71,40 @@ def read_user(user_id: int):
     response_model=schemas.Item,
     dependencies=[Depends(get_db)],
 )
+@offload(default_threadpool)
 def create_item_for_user(user_id: int, item: schemas.ItemCreate):
     return crud.create_user_item(item=item, user_id=user_id)
 
 @app.get("/items/", response_model=List[schemas.Item], dependencies=[Depends(get_db)])
+@offload(default_threadpool)
 def read_items(skip: int = 0, limit: int = 100):
     items = crud.get_items(skip=skip, limit=limit)
     return items
 
 @app.get(
-    "/slowusers/", response_model=List[schemas.User], dependencies=[Depends(get_db)]
+    "/slowusers/", response_model=List[schemas.User], dependencies=[Depends(reset_db_state)]
 )
+@offload(slow_executor)
 def read_slow_users(skip: int = 0, limit: int = 100):
+    # Runs on slow_executor, not the shared threadpool, and only holds a pooled connection for the query
     global sleep_time
     sleep_time = max(0, sleep_time - 1)
     time.sleep(sleep_time)  # Fake long processing request
-    users = crud.get_users(skip=skip, limit=limit)
-    return users
\ No newline at end of file
+    with database.db.connection_context():
+        users = crud.get_users(skip=skip, limit=limit)
+    return users
+
+@app.get("/health/ready", dependencies=[Depends(reset_db_state)])
+def read_readiness(response: Response):
+    if not schema_ready():
+        response.status_code = status.HTTP_503_SERVICE_UNAVAILABLE
+        return {"ready": False}
+    return {"ready": True}
+
+@app.get("/metrics/pool")
+def read_pool_metrics():
+    return database.db.stats()
+
+@app.get("/metrics/threadpools")
+async def read_threadpool_metrics():
+    return {"default": default_threadpool_stats(), "slow": slow_executor.stats()}
\ No newline at end of file
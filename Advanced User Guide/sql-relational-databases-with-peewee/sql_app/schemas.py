@@ -6,6 +6,7 @@ from pydantic.utils import GetterDict
 class PeeweeGetterDict(GetterDict):
     def get(self, key: Any, default: Any = None):
         res = getattr(self._obj, key, default)
+        # Backrefs filled by crud's prefetch() are already plain lists; only a bare ModelSelect still queries
         if isinstance(res, peewee.ModelSelect):
             return list(res)
         return res
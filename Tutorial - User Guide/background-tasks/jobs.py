@@ -0,0 +1,230 @@
+import multiprocessing
+import pickle
+import random
+import sqlite3
+import threading
+import time
+import traceback
+from typing import Callable, Optional
+
+# Jobs live in an SQLite file until a worker finishes them, so anything queued survives a restart.
+# A job is a pickled (func, args, kwargs); func must be a module-level function, importable by the
+# worker processes, the same rule as ProcessPoolExecutor
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id INTEGER PRIMARY KEY,
+    payload BLOB NOT NULL,
+    status TEXT NOT NULL DEFAULT 'queued',
+    attempts INTEGER NOT NULL DEFAULT 0,
+    max_attempts INTEGER NOT NULL,
+    run_at REAL NOT NULL,
+    lease_until REAL,
+    last_error TEXT
+);
+CREATE INDEX IF NOT EXISTS ix_jobs_status_run_at ON jobs (status, run_at);
+"""
+
+
+class JobStore:
+    def __init__(self, path: str):
+        self.path = path
+        self.local = threading.local()
+        self.connection().executescript(SCHEMA)
+
+    def connection(self):
+        conn = getattr(self.local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5.0, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self.local.conn = conn
+        return conn
+
+    def enqueue(self, payload: bytes, max_attempts: int, delay: float = 0.0) -> int:
+        cur = self.connection().execute(
+            "INSERT INTO jobs (payload, max_attempts, run_at) VALUES (?, ?, ?)",
+            (payload, max_attempts, time.time() + delay),
+        )
+        return cur.lastrowid
+
+    def claim(self, lease: float):
+        # One UPDATE ... RETURNING, so two workers can never take the same job. A 'running' job
+        # whose lease ran out belonged to a worker that died or was killed mid-deploy and is retried,
+        # unless that was its last attempt: a job that keeps killing its worker must not loop forever
+        now = time.time()
+        conn = self.connection()
+        with conn:
+            conn.execute("BEGIN IMMEDIATE")
+            conn.execute(
+                """UPDATE jobs SET status = 'failed', lease_until = NULL,
+                     last_error = coalesce(last_error, 'worker lost while running the job')
+                   WHERE status = 'running' AND lease_until < ? AND attempts >= max_attempts""",
+                (now,),
+            )
+            return conn.execute(
+                """UPDATE jobs SET status = 'running', attempts = attempts + 1, lease_until = ?
+                   WHERE id = (
+                     SELECT id FROM jobs
+                     WHERE (status = 'queued' AND run_at <= ?) OR (status = 'running' AND lease_until < ?)
+                     ORDER BY run_at, id LIMIT 1
+                   )
+                   RETURNING id, payload, attempts, max_attempts""",
+                (now + lease, now, now),
+            ).fetchone()
+
+    def extend(self, job_id: int, lease: float):
+        self.connection().execute(
+            "UPDATE jobs SET lease_until = ? WHERE id = ? AND status = 'running'",
+            (time.time() + lease, job_id),
+        )
+
+    def complete(self, job_id: int):
+        self.connection().execute("DELETE FROM jobs WHERE id = ?", (job_id,))
+
+    def retry(self, job_id: int, delay: float, error: str):
+        self.connection().execute(
+            "UPDATE jobs SET status = 'queued', run_at = ?, lease_until = NULL, last_error = ? WHERE id = ?",
+            (time.time() + delay, error, job_id),
+        )
+
+    def fail(self, job_id: int, error: str):
+        # Out of attempts: kept as 'failed' for inspection instead of being dropped
+        self.connection().execute(
+            "UPDATE jobs SET status = 'failed', lease_until = NULL, last_error = ? WHERE id = ?",
+            (error, job_id),
+        )
+
+    def stats(self):
+        rows = self.connection().execute("SELECT status, count(*) FROM jobs GROUP BY status")
+        return dict(rows.fetchall())
+
+
+def backoff(attempts: int, base: float, cap: float) -> float:
+    # Exponential with full jitter, so a failing dependency isn't hit by every retry at once
+    return random.uniform(0, min(cap, base * 2 ** (attempts - 1)))
+
+
+def renew_lease(store, job_id, lease, done):
+    # Keeps a long job's lease ahead of the clock, so it isn't claimed again while still running
+    while not done.wait(lease / 3):
+        store.extend(job_id, lease)
+
+
+def worker_main(path, stop, lease, poll_interval, backoff_base, backoff_cap, initializer, finalizer):
+    if initializer is not None:
+        initializer()
+    store = JobStore(path)
+    try:
+        while not stop.is_set():
+            job = store.claim(lease)
+            if job is None:
+                stop.wait(poll_interval)
+                continue
+            job_id, payload, attempts, max_attempts = job
+            done = threading.Event()
+            threading.Thread(target=renew_lease, args=(store, job_id, lease, done), daemon=True).start()
+            try:
+                func, args, kwargs = pickle.loads(payload)
+                func(*args, **kwargs)
+            except Exception:
+                error = traceback.format_exc()
+                if attempts >= max_attempts:
+                    store.fail(job_id, error)
+                else:
+                    store.retry(job_id, backoff(attempts, backoff_base, backoff_cap), error)
+            else:
+                store.complete(job_id)
+            finally:
+                done.set()
+    finally:
+        if finalizer is not None:
+            finalizer()
+
+
+class JobQueue:
+    # add_task() has the BackgroundTasks signature, but the work runs in a pool of worker
+    # processes, after the job is committed to the store, instead of in the web process
+    def __init__(
+        self,
+        path: str,
+        workers: int = 2,
+        max_attempts: int = 5,
+        lease: float = 60.0,
+        poll_interval: float = 0.2,
+        backoff_base: float = 1.0,
+        backoff_cap: float = 300.0,
+        initializer: Optional[Callable[[], None]] = None,
+        finalizer: Optional[Callable[[], None]] = None,
+        supervise_interval: float = 1.0,
+    ):
+        self.path = path
+        self.workers = workers
+        self.max_attempts = max_attempts
+        self.lease = lease
+        self.poll_interval = poll_interval
+        self.backoff_base = backoff_base
+        self.backoff_cap = backoff_cap
+        self.initializer = initializer
+        self.finalizer = finalizer
+        # The store (and its DDL) is opened in start(), not at import: spawned workers import
+        # the app module too, and open their own store in worker_main
+        self.store = None
+        # spawn: the web process has threads running, which fork would copy in an unknown state
+        self.context = multiprocessing.get_context("spawn")
+        self.supervise_interval = supervise_interval
+        self.stop = None
+        self.processes = []
+        self.restarts = 0
+
+    def add_task(self, func: Callable, *args, **kwargs) -> int:
+        return self.store.enqueue(pickle.dumps((func, args, kwargs)), self.max_attempts)
+
+    def spawn(self, index: int):
+        process = self.context.Process(
+            target=worker_main,
+            args=(
+                self.path, self.stop, self.lease, self.poll_interval, self.backoff_base,
+                self.backoff_cap, self.initializer, self.finalizer,
+            ),
+            name=f"job-worker-{index}",
+            daemon=True,
+        )
+        process.start()
+        return process
+
+    def start(self):
+        if self.store is None:
+            self.store = JobStore(self.path)
+        self.stop = self.context.Event()
+        self.restarts = 0
+        self.processes = [self.spawn(i) for i in range(self.workers)]
+        self.supervisor = threading.Thread(target=self.supervise, name="job-supervisor", daemon=True)
+        self.supervisor.start()
+
+    def supervise(self):
+        # A worker that crashed or was OOM-killed is replaced, so the pool never quietly shrinks
+        stop = self.stop
+        while not stop.wait(self.supervise_interval):
+            for i, process in enumerate(self.processes):
+                if not process.is_alive() and not stop.is_set():
+                    process.join()
+                    self.processes[i] = self.spawn(i)
+                    self.restarts += 1
+
+    def close(self, timeout: Optional[float] = None):
+        # Workers finish the job in hand and exit; whatever is still queued runs after the next start()
+        if self.stop is not None:
+            self.stop.set()
+            self.supervisor.join()
+            for process in self.processes:
+                process.join(timeout)
+            self.stop = None
+            self.processes = []
+
+    def stats(self):
+        return {
+            "workers": self.workers,
+            "alive": sum(process.is_alive() for process in self.processes),
+            "restarts": self.restarts,
+            "jobs": self.store.stats(),
+        }
@@ -15,14 +15,117 @@ async def send_notification(email: str, background_tasks: BackgroundTasks):
 """
  
 # Dependency Injection
+import os
+import queue
+import threading
+import time
 from typing import Optional
 from fastapi import BackgroundTasks, Depends, FastAPI
 
+from jobs import JobQueue
+
 app = FastAPI()
 
+JOB_WORKERS = int(os.environ.get("JOB_WORKERS", "2"))
+
+class BufferedLogWriter:
+    # One thread owns the open file and writes queued messages in batches, every `flush_size`
+    # messages or `flush_interval` seconds, instead of an open/write/close per task.
+    # durability: "none" leaves data in Python's buffer, "flush" hands each batch to the OS,
+    # "fsync" also forces it to disk
+    _STOP = object()
+
+    def __init__(self, path: str, flush_size: int = 1000, flush_interval: float = 1.0, durability: str = "flush"):
+        self.path = path
+        self.flush_size = flush_size
+        self.flush_interval = flush_interval
+        self.durability = durability
+        self.queue = queue.SimpleQueue()
+        self.thread = None
+
+    def write(self, message: str):
+        self.queue.put(message)
+
+    def flush(self):
+        # Blocks until everything written before the call is out, with the writer's durability
+        if self.thread is not None:
+            done = threading.Event()
+            self.queue.put(done)
+            done.wait()
+
+    def start(self):
+        self.thread = threading.Thread(target=self._run, name="log-writer", daemon=True)
+        self.thread.start()
+
+    def close(self):
+        # Everything queued before close() is written before it returns
+        if self.thread is not None:
+            self.queue.put(self._STOP)
+            self.thread.join()
+            self.thread = None
+
+    def _run(self):
+        with open(self.path, mode="a") as log:
+            batch = []
+            deadline = time.monotonic() + self.flush_interval
+            while True:
+                try:
+                    message = self.queue.get(timeout=max(0.0, deadline - time.monotonic()))
+                except queue.Empty:
+                    message = None
+                if message is self._STOP:
+                    self._write(log, batch)
+                    return
+                if isinstance(message, threading.Event):
+                    self._write(log, batch)
+                    batch = []
+                    message.set()
+                    continue
+                if message is not None:
+                    batch.append(message)
+                if len(batch) >= self.flush_size or time.monotonic() >= deadline:
+                    self._write(log, batch)
+                    batch = []
+                    deadline = time.monotonic() + self.flush_interval
+
+    def _write(self, log, batch):
+        if not batch:
+            return
+        log.write("".join(batch))
+        if self.durability in ("flush", "fsync"):
+            log.flush()
+        if self.durability == "fsync":
+            os.fsync(log.fileno())
+
+log_writer = BufferedLogWriter("log.txt")
+
+def start_log_writer():
+    log_writer.start()
+
+def stop_log_writer():
+    log_writer.close()
+
+# Notifications go through a durable queue run by worker processes; each worker has its own log_writer
+jobs = JobQueue("jobs.db", workers=JOB_WORKERS, initializer=start_log_writer, finalizer=stop_log_writer)
+
+@app.on_event("startup")
+def start_background_workers():
+    start_log_writer()
+    jobs.start()
+
+@app.on_event("shutdown")
+def stop_background_workers():
+    jobs.close()
+    stop_log_writer()
+
 def write_log(message: str):
-    with open("log.txt", mode="a") as log:
-        log.write(message)
+    log_writer.write(message)
+
+def write_notification(message: str):
+    # Runs as a job: the message must reach log.txt before the worker marks the job complete,
+    # otherwise a worker killed in between loses it with the job already deleted
+    log_writer.write(message)
+    log_writer.flush()
 
 def get_query(background_tasks: BackgroundTasks, q: Optional[str] = None):
     if q:
@@ -30,10 +133,15 @@ def get_query(background_tasks: BackgroundTasks, q: Optional[str] = None):
         background_tasks.add_task(write_log, message)
     return q
 
+# A plain def: enqueueing is a blocking SQLite write, so it runs in the threadpool, not on the event loop
 @app.post("/send-notification/{email}")
-async def send_notification(
+def send_notification(
     email: str, background_tasks: BackgroundTasks, q: str = Depends(get_query)
 ):
     message = f"message to {email}\n"
-    background_tasks.add_task(write_log, message)
-    return {"message": "Message sent"}
\ No newline at end of file
+    jobs.add_task(write_notification, message)
+    return {"message": "Message sent"}
+
+@app.get("/metrics/jobs")
+def job_metrics():
+    return jobs.stats()
\ No newline at end of file
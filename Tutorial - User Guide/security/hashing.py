@@ -0,0 +1,17 @@
+# Password hashing, kept apart from main.py: the bcrypt worker processes import only this module,
+# without building the app or touching the rate-limit and revocation files
+import time
+from passlib.context import CryptContext
+
+pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+
+def verify_password(plain_password, hashed_password):
+    return pwd_context.verify(plain_password, hashed_password)
+
+def get_password_hash(password):
+    return pwd_context.hash(password)
+
+def timed_verify_password(plain_password, hashed_password, enqueued: float):
+    # Runs in a worker process, reports how long the check waited before it started
+    queue_time = time.time() - enqueued
+    return verify_password(plain_password, hashed_password), queue_time
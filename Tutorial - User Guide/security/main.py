@@ -83,19 +83,44 @@ async def read_users_me(current_user: User = Depends(get_current_active_user)):
 """
 
 # OAuth2 with Password (and hashing), Bearer with JWT tokens
+import asyncio
+import hashlib
+import math
+import multiprocessing
+import os
+import random
+import sqlite3
+import tempfile
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
 from datetime import datetime, timedelta
 from typing import Optional
-from fastapi import Depends, FastAPI, HTTPException, status
+from fastapi import Depends, FastAPI, HTTPException, Request, status
+from fastapi.concurrency import run_in_threadpool
 from fastapi.security import OAuth2PasswordBearer, OAuth2PasswordRequestForm
 from jose import JWTError, jwt
-from passlib.context import CryptContext
 from pydantic import BaseModel
+from hashing import get_password_hash, timed_verify_password, verify_password
 
 # to get a string like this run:
 # openssl rand -hex 32
 SECRET_KEY = "09d25e094faa6ca2556c818166b7a9563b93f7099f6f0f4caa6cf63b88e8d3e7"
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 30
+# bcrypt runs in worker processes; at most HASH_CONCURRENCY checks are handed to them at once
+HASH_WORKERS = 2
+HASH_CONCURRENCY = 8
+# /token limits, per client IP and per username, shared by all workers through RATE_LIMIT_DB
+LOGIN_IP_BURST = 20
+LOGIN_IP_PER_SECOND = 1.0
+LOGIN_USER_BURST = 5
+LOGIN_USER_PER_SECOND = 0.1
+RATE_LIMIT_DB = os.path.join("/dev/shm" if os.path.isdir("/dev/shm") else tempfile.gettempdir(), "security_token_rate_limit.db")
+# Revocations must outlive restarts, so this file is kept on disk (next to this module) rather than in /dev/shm
+REVOCATION_DB = os.path.join(os.path.dirname(os.path.abspath(__file__)), "revocations.db")
 
 fake_users_db = {
     "johndoe": {
@@ -113,6 +138,8 @@ class Token(BaseModel):
 
 class TokenData(BaseModel):
     username: Optional[str] = None
+    jti: Optional[str] = None
+    iat: Optional[float] = None
 
 class User(BaseModel):
     username: str
@@ -123,28 +150,41 @@ class User(BaseModel):
 class UserInDB(User):
     hashed_password: str
 
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
-
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="token")
 
 app = FastAPI()
 
-def verify_password(plain_password, hashed_password):
-    return pwd_context.verify(plain_password, hashed_password)
-
-def get_password_hash(password):
-    return pwd_context.hash(password)
+password_executor = None
+hash_semaphore = asyncio.Semaphore(HASH_CONCURRENCY)
+hash_stats = {"verifications": 0, "in_flight": 0, "queue_time_total": 0.0, "queue_time_max": 0.0}
+
+async def verify_password_async(plain_password, hashed_password):
+    # Keeps the ~250 ms bcrypt check off the event loop
+    enqueued = time.time()
+    async with hash_semaphore:
+        hash_stats["in_flight"] += 1
+        try:
+            loop = asyncio.get_running_loop()
+            verified, queue_time = await loop.run_in_executor(
+                password_executor, timed_verify_password, plain_password, hashed_password, enqueued
+            )
+        finally:
+            hash_stats["in_flight"] -= 1
+    hash_stats["verifications"] += 1
+    hash_stats["queue_time_total"] += queue_time
+    hash_stats["queue_time_max"] = max(hash_stats["queue_time_max"], queue_time)
+    return verified
 
 def get_user(db, username: str):
     if username in db:
         user_dict = db[username]
         return UserInDB(**user_dict)
 
-def authenticate_user(fake_db, username: str, password: str):
+async def authenticate_user(fake_db, username: str, password: str):
     user = get_user(fake_db, username)
     if not user:
         return False
-    if not verify_password(password, user.hashed_password):
+    if not await verify_password_async(password, user.hashed_password):
         return False
     return user
 
@@ -154,26 +194,231 @@ def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
         expire = datetime.utcnow() + expires_delta
     else:
         expire = datetime.utcnow() + timedelta(minutes=15)
-    to_encode.update({"exp": expire})
+    # jti and a sub-second iat let a single token, or everything issued before a moment, be revoked
+    to_encode.update({"exp": expire, "jti": uuid.uuid4().hex, "iat": time.time()})
     encoded_jwt = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
     return encoded_jwt
 
+class BloomFilter:
+    # Fixed-size bit array; "no" answers are exact, "maybe" answers go to the authoritative set
+    def __init__(self, size_bits: int = 1 << 20, hashes: int = 7):
+        self.size_bits = size_bits
+        self.hashes = hashes
+        self.bits = bytearray(size_bits // 8)
+
+    def _positions(self, key: str):
+        digest = hashlib.blake2b(key.encode(), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], "little")
+        h2 = int.from_bytes(digest[8:], "little") | 1
+        return [(h1 + i * h2) % self.size_bits for i in range(self.hashes)]
+
+    def add(self, key: str):
+        for position in self._positions(key):
+            self.bits[position >> 3] |= 1 << (position & 7)
+
+    def __contains__(self, key: str) -> bool:
+        return all(self.bits[position >> 3] & (1 << (position & 7)) for position in self._positions(key))
+
+class RevocationStore:
+    # Revoked jti -> exp and per-user "issued before" cutoffs live in one SQLite file, so a
+    # revocation made through any worker applies to all of them and survives a restart.
+    # Requests only read this worker's in-memory copy: a Bloom filter of revoked jtis and the
+    # cutoffs. A background thread syncs it from the file every `refresh_interval` seconds (a
+    # version counter tells it when something changed), which bounds how long a revocation made
+    # on another worker can go unseen. Only "maybe" answers from the filter are looked up in the file
+    SCHEMA = """
+    CREATE TABLE IF NOT EXISTS revoked_tokens (id INTEGER PRIMARY KEY AUTOINCREMENT, jti TEXT UNIQUE NOT NULL, exp REAL NOT NULL);
+    CREATE TABLE IF NOT EXISTS revoked_users (username TEXT PRIMARY KEY, before REAL NOT NULL);
+    CREATE TABLE IF NOT EXISTS revocation_version (id INTEGER PRIMARY KEY CHECK (id = 1), version INTEGER NOT NULL);
+    INSERT OR IGNORE INTO revocation_version (id, version) VALUES (1, 0);
+    """
+
+    def __init__(self, path: str, refresh_interval: float = 1.0, purge_interval: float = 600):
+        self.path = path
+        self.local = threading.local()
+        self.lock = threading.Lock()
+        self.connection().executescript(self.SCHEMA)
+        self.refresh_interval = refresh_interval
+        self.purge_interval = purge_interval
+        self.next_purge = time.time() + purge_interval
+        self.bloom = BloomFilter()
+        self.revoked_before = {}
+        self.version = None
+        self.last_id = 0
+        self.refresh()
+        self.stopped = threading.Event()
+        self.thread = None
+
+    def connection(self):
+        conn = getattr(self.local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5.0, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=FULL")  # a revocation must not be lost in a crash
+            self.local.conn = conn
+        return conn
+
+    def start(self):
+        self.thread = threading.Thread(target=self.run, name="revocation-refresher", daemon=True)
+        self.thread.start()
+
+    def close(self):
+        self.stopped.set()
+        if self.thread is not None:
+            self.thread.join()
+
+    def run(self):
+        while not self.stopped.wait(self.refresh_interval):
+            try:
+                if time.time() > self.next_purge:
+                    self.purge()
+                else:
+                    self.refresh()
+            except sqlite3.OperationalError:
+                pass  # the file was busy, the next tick tries again
+
+    def refresh(self, full: bool = False):
+        # Builds on the side and swaps in, so a request never sees a half-loaded filter
+        with self.lock:
+            conn = self.connection()
+            (version,) = conn.execute("SELECT version FROM revocation_version").fetchone()
+            if version == self.version and not full:
+                return
+            bloom, last_id = (BloomFilter(self.bloom.size_bits, self.bloom.hashes), 0) if full else (self.bloom, self.last_id)
+            # AUTOINCREMENT ids are never reused, so "id > last_id" finds exactly the new rows
+            for row_id, jti in conn.execute("SELECT id, jti FROM revoked_tokens WHERE id > ?", (last_id,)):
+                bloom.add(jti)
+                last_id = max(last_id, row_id)
+            self.revoked_before = dict(conn.execute("SELECT username, before FROM revoked_users"))
+            self.bloom, self.last_id, self.version = bloom, last_id, version
+
+    def bump(self, conn):
+        conn.execute("UPDATE revocation_version SET version = version + 1")
+
+    def revoke_token(self, jti: str, exp: float):
+        # Blocking write, call it through run_in_threadpool
+        conn = self.connection()
+        with conn:
+            conn.execute("BEGIN IMMEDIATE")
+            conn.execute("INSERT OR IGNORE INTO revoked_tokens (jti, exp) VALUES (?, ?)", (jti, exp))
+            self.bump(conn)
+        self.refresh()
+
+    def revoke_user(self, username: str, before: Optional[float] = None) -> float:
+        # Blocking write, call it through run_in_threadpool
+        before = time.time() if before is None else before
+        conn = self.connection()
+        with conn:
+            conn.execute("BEGIN IMMEDIATE")
+            conn.execute(
+                """INSERT INTO revoked_users (username, before) VALUES (?, ?)
+                   ON CONFLICT(username) DO UPDATE SET before = max(before, excluded.before)""",
+                (username, before),
+            )
+            self.bump(conn)
+        self.refresh()
+        return self.revoked_before[username]
+
+    def is_listed(self, jti: str) -> bool:
+        row = self.connection().execute("SELECT 1 FROM revoked_tokens WHERE jti = ?", (jti,)).fetchone()
+        return row is not None
+
+    async def is_revoked(self, token_data: TokenData) -> bool:
+        # The common not-revoked case is a dict lookup and a few bit tests, no I/O
+        cutoff = self.revoked_before.get(token_data.username)
+        if cutoff is not None and (token_data.iat is None or token_data.iat < cutoff):
+            return True
+        if token_data.jti is None or token_data.jti not in self.bloom:
+            return False
+        return await run_in_threadpool(self.is_listed, token_data.jti)
+
+    def purge(self):
+        # Expired tokens can't be used anyway; bits can't be cleared, so the filter is rebuilt
+        self.connection().execute("DELETE FROM revoked_tokens WHERE exp <= ?", (time.time(),))
+        self.refresh(full=True)
+        self.next_purge = time.time() + self.purge_interval
+
+# Opened in a startup hook, importing the module doesn't touch the database
+revocations = None
+
+@app.on_event("startup")
+def open_revocations():
+    global revocations
+    revocations = RevocationStore(REVOCATION_DB)
+    revocations.start()
+
+@app.on_event("shutdown")
+def close_revocations():
+    if revocations is not None:
+        revocations.close()
+
+class TokenCache:
+    # Verified token -> decoded result, dropped at the token's own `exp`; bumping a user's
+    # generation invalidates every token cached for them
+    def __init__(self, maxsize: int = 10000):
+        self.maxsize = maxsize
+        self.entries = OrderedDict()
+        self.generations = {}
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, token: str):
+        entry = self.entries.get(token)
+        if entry is not None:
+            exp, generation, username, value = entry
+            if exp > time.time() and generation == self.generations.get(username, 0):
+                self.entries.move_to_end(token)
+                self.hits += 1
+                return value
+            del self.entries[token]
+        self.misses += 1
+        return None
+
+    def set(self, token: str, exp: float, username: str, value):
+        self.entries[token] = (exp, self.generations.get(username, 0), username, value)
+        self.entries.move_to_end(token)
+        if len(self.entries) > self.maxsize:
+            self.entries.popitem(last=False)
+
+    def invalidate_user(self, username: str):
+        self.generations[username] = self.generations.get(username, 0) + 1
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "size": len(self.entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+        }
+
+token_cache = TokenCache()
+
 async def get_current_user(token: str = Depends(oauth2_scheme)):
     credentials_exception = HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
         detail="Could not validate credentials",
         headers={"WWW-Authenticate": "Bearer"},
     )
-    try:
-        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-        username: str = payload.get("sub")
-        if username is None:
+    cached = token_cache.get(token)
+    if cached is not None:
+        token_data, user = cached
+    else:
+        try:
+            payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+            username: str = payload.get("sub")
+            if username is None:
+                raise credentials_exception
+            token_data = TokenData(username=username, jti=payload.get("jti"), iat=payload.get("iat"))
+        except JWTError:
             raise credentials_exception
-        token_data = TokenData(username=username)
-    except JWTError:
-        raise credentials_exception
-    user = get_user(fake_users_db, username=token_data.username)
-    if user is None:
+        user = get_user(fake_users_db, username=token_data.username)
+        if user is None:
+            raise credentials_exception
+        if payload.get("exp") is not None:
+            token_cache.set(token, payload["exp"], user.username, (token_data, user))
+    # Checked on every request, cached or not, against this worker's in-memory revocation snapshot
+    if await revocations.is_revoked(token_data):
         raise credentials_exception
     return user
 
@@ -182,9 +427,110 @@ async def get_current_active_user(current_user: User = Depends(get_current_user)
         raise HTTPException(status_code=400, detail="Inactive user")
     return current_user
 
-@app.post("/token", response_model=Token)
+class SQLiteRateLimiter:
+    # Token buckets kept in one SQLite file, so every worker process on the host shares the counters.
+    # Each check is a single atomic UPSERT ... RETURNING; the file lives in /dev/shm when available
+    def __init__(self, path: str):
+        self.path = path
+        self.local = threading.local()
+        with self.connection() as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS buckets (key TEXT PRIMARY KEY, tokens REAL, updated REAL)"
+            )
+
+    def connection(self):
+        conn = getattr(self.local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=1.0)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=OFF")  # losing counters in a crash is harmless
+            self.local.conn = conn
+        return conn
+
+    def acquire(self, limits) -> float:
+        # limits: [(key, burst, refill_per_second)]; a request needs a token from every bucket.
+        # Returns 0 when allowed, otherwise the seconds until the emptiest rejecting bucket has one
+        now = time.time()
+        retry_after = 0.0
+        with self.connection() as conn:
+            for key, burst, rate in limits:
+                (tokens,) = conn.execute(
+                    """INSERT INTO buckets (key, tokens, updated) VALUES (?, ?, ?)
+                       ON CONFLICT(key) DO UPDATE SET
+                         tokens = max(min(excluded.tokens + 1, tokens + (excluded.updated - updated) * ?) - 1, -1),
+                         updated = excluded.updated
+                       RETURNING tokens""",
+                    (key, burst - 1, now, rate),
+                ).fetchone()
+                if tokens < 0:
+                    retry_after = max(retry_after, (1 - tokens) / rate)
+            if random.random() < 0.001:
+                conn.execute("DELETE FROM buckets WHERE updated < ?", (now - 3600,))
+        return retry_after
+
+# Opened in a startup hook, importing the module doesn't touch the database
+login_limiter = None
+
+@app.on_event("startup")
+def open_login_limiter():
+    global login_limiter
+    login_limiter = SQLiteRateLimiter(RATE_LIMIT_DB)
+
+def check_login_rate(request: Request, form_data: OAuth2PasswordRequestForm = Depends()):
+    client = request.client.host if request.client else "unknown"
+    limits = [
+        (f"ip:{client}", LOGIN_IP_BURST, LOGIN_IP_PER_SECOND),
+        (f"user:{form_data.username}", LOGIN_USER_BURST, LOGIN_USER_PER_SECOND),
+    ]
+    retry_after = login_limiter.acquire(limits)
+    if retry_after:
+        raise HTTPException(
+            status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+            detail="Too many login attempts",
+            headers={"Retry-After": str(math.ceil(retry_after))},
+        )
+
+@app.on_event("startup")
+def start_password_executor():
+    # forkserver: forking the threaded server process could copy a lock held by another thread.
+    # The workers are started, and have imported hashing and loaded bcrypt, before the first login,
+    # so none of that is counted as queue time
+    global password_executor
+    password_executor = ProcessPoolExecutor(
+        max_workers=HASH_WORKERS, mp_context=multiprocessing.get_context("forkserver")
+    )
+    warm_up_hash = fake_users_db["johndoe"]["hashed_password"]
+    warm_ups = [
+        password_executor.submit(timed_verify_password, "", warm_up_hash, time.time())
+        for _ in range(HASH_WORKERS)
+    ]
+    for future in warm_ups:
+        future.result()
+
+@app.on_event("shutdown")
+def stop_password_executor():
+    if password_executor is not None:
+        password_executor.shutdown()
+
+@app.get("/metrics/password-hashing")
+async def read_password_hashing_metrics():
+    verifications = hash_stats["verifications"]
+    return {
+        "workers": HASH_WORKERS,
+        "max_concurrency": HASH_CONCURRENCY,
+        "in_flight": hash_stats["in_flight"],
+        "verifications": verifications,
+        "queue_time_avg": hash_stats["queue_time_total"] / verifications if verifications else 0.0,
+        "queue_time_max": hash_stats["queue_time_max"],
+    }
+
+@app.get("/metrics/token-cache")
+async def read_token_cache_metrics():
+    return token_cache.stats()
+
+@app.post("/token", response_model=Token, dependencies=[Depends(check_login_rate)])
 async def login_for_access_token(form_data: OAuth2PasswordRequestForm = Depends()):
-    user = authenticate_user(fake_users_db, form_data.username, form_data.password)
+    user = await authenticate_user(fake_users_db, form_data.username, form_data.password)
     if not user:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
@@ -197,6 +543,22 @@ async def login_for_access_token(form_data: OAuth2PasswordRequestForm = Depends(
     )
     return {"access_token": access_token, "token_type": "bearer"}
 
+@app.post("/token/revoke")
+async def revoke_current_token(
+    token: str = Depends(oauth2_scheme), current_user: User = Depends(get_current_user)
+):
+    payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+    if payload.get("jti") is None:
+        raise HTTPException(status_code=400, detail="Token has no jti, use /users/me/revoke-tokens")
+    await run_in_threadpool(revocations.revoke_token, payload["jti"], payload["exp"])
+    return {"revoked": payload["jti"]}
+
+@app.post("/users/me/revoke-tokens")
+async def revoke_all_tokens(current_user: User = Depends(get_current_user)):
+    revoked_before = await run_in_threadpool(revocations.revoke_user, current_user.username)
+    token_cache.invalidate_user(current_user.username)
+    return {"revoked_before": revoked_before}
+
 @app.get("/users/me/", response_model=User)
 async def read_users_me(current_user: User = Depends(get_current_active_user)):
     return current_user
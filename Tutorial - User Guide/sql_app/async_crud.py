@@ -0,0 +1,108 @@
+from itertools import islice
+from typing import Iterable, List, Optional, Tuple
+from sqlalchemy import insert, select
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import joinedload, selectinload
+from sqlalchemy.orm.attributes import set_committed_value
+from . import crud as sync_crud, models, schemas
+from .crud import ITEM_EXPORT_COLUMNS, USER_EXPORT_COLUMNS, search_items_query, stream_query
+
+# Async twins of crud.py, sharing its statements and cache. The cache is looked up as
+# sync_crud.user_cache on every call, so swapping it (e.g. for a shared backend) covers both modes.
+# Relationships are always loaded eagerly, lazy loads can't run under AsyncSession
+
+async def get_user(db: AsyncSession, user_id: int):
+    result = await db.execute(
+        select(models.User)
+        .options(joinedload(models.User.items))
+        .filter(models.User.id == user_id)
+    )
+    return result.unique().scalars().first()
+
+async def get_user_cached(db: AsyncSession, user_id: int) -> Optional[schemas.User]:
+    key = f"user:{user_id}"
+    user = sync_crud.user_cache.get(key)
+    if user is None:
+        db_user = await get_user(db, user_id=user_id)
+        if db_user is None:
+            return None
+        user = schemas.User.from_orm(db_user)
+        sync_crud.user_cache.set(key, user)
+    return user
+
+async def get_user_by_email(db: AsyncSession, email: str):
+    result = await db.execute(select(models.User).filter(models.User.email == email))
+    return result.scalars().first()
+
+async def get_users(db: AsyncSession, skip: int = 0, limit: int = 100, after_id: Optional[int] = None):
+    query = select(models.User).options(selectinload(models.User.items)).order_by(models.User.id)
+    if after_id is not None:
+        query = query.filter(models.User.id > after_id)
+    else:
+        query = query.offset(skip)
+    result = await db.execute(query.limit(limit))
+    return result.scalars().all()
+
+async def create_user(db: AsyncSession, user: schemas.UserCreate):
+    fake_hashed_password = user.password + "notreallyhashed"
+    stmt = insert(models.User).returning(models.User)
+    result = await db.scalars(stmt, [{"email": user.email, "hashed_password": fake_hashed_password}])
+    db_user = result.one()
+    set_committed_value(db_user, "items", [])
+    await db.commit()
+    return db_user
+
+async def get_items(db: AsyncSession, skip: int = 0, limit: int = 100, after_id: Optional[int] = None):
+    query = select(models.Item).order_by(models.Item.id)
+    if after_id is not None:
+        query = query.filter(models.Item.id > after_id)
+    else:
+        query = query.offset(skip)
+    result = await db.execute(query.limit(limit))
+    return result.scalars().all()
+
+async def search_items(db: AsyncSession, q: str, limit: int = 100, after: Optional[Tuple[float, int]] = None):
+    query = search_items_query(q, limit=limit, after=after)
+    if query is None:
+        return []
+    result = await db.execute(query)
+    return result.all()
+
+async def create_user_item(db: AsyncSession, item: schemas.ItemCreate, user_id: int) -> schemas.Item:
+    stmt = insert(models.Item).returning(models.Item)
+    result = await db.scalars(stmt, [dict(item.dict(), owner_id=user_id)])
+    new_item = schemas.Item.from_orm(result.one())
+    await db.commit()
+    sync_crud.user_cache.delete(f"user:{user_id}")
+    return new_item
+
+async def insert_user_items(db: AsyncSession, items: Iterable[schemas.ItemCreate], user_id: int, chunk_size: int = 1000) -> List[int]:
+    stmt = insert(models.Item).returning(models.Item.id)
+    items = iter(items)
+    ids = []
+    while True:
+        chunk = [dict(item.dict(), owner_id=user_id) for item in islice(items, chunk_size)]
+        if not chunk:
+            return ids
+        ids.extend(sorted(await db.scalars(stmt, chunk)))
+
+async def create_user_items(db: AsyncSession, items: Iterable[schemas.ItemCreate], user_id: int) -> List[int]:
+    try:
+        ids = await insert_user_items(db, items, user_id)
+        await db.commit()
+    except Exception:
+        await db.rollback()
+        raise
+    sync_crud.user_cache.delete(f"user:{user_id}")
+    return ids
+
+async def stream_rows(db: AsyncSession, columns, batch_size: int = 1000):
+    result = await db.stream(stream_query(columns, batch_size))
+    async for rows in result.partitions():
+        yield rows
+
+def stream_users(db: AsyncSession, batch_size: int = 1000):
+    return stream_rows(db, USER_EXPORT_COLUMNS, batch_size)
+
+def stream_items(db: AsyncSession, batch_size: int = 1000):
+    return stream_rows(db, ITEM_EXPORT_COLUMNS, batch_size)
@@ -0,0 +1,143 @@
+# Async mode, served when SQL_APP_ASYNC=1 (see the end of main.py); needs aiosqlite or asyncpg.
+# Same routes as main.py in the same order, keep the two in step
+from typing import List, Optional
+from fastapi import Depends, FastAPI, HTTPException, Query, Request, Response, status
+from fastapi.concurrency import run_in_threadpool
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import AsyncSession
+from . import async_crud as crud, crud as sync_crud, schemas
+from .async_database import AsyncReadSessionLocal, AsyncSessionLocal
+from .export import export_response
+from .init_db import init_db, schema_ready
+from .instrumentation import QueryStatsMiddleware, query_metrics
+from .ndjson import read_spool, spool_ndjson
+from .pagination import decode_cursor, decode_rank_cursor, encode_rank_cursor, set_next_cursor
+
+app = FastAPI()
+
+app.add_middleware(QueryStatsMiddleware)
+
+@app.on_event("startup")
+async def create_schema():
+    # Shares the init step with sync mode, so the FTS index exists here too
+    if not await run_in_threadpool(schema_ready):
+        await run_in_threadpool(init_db)
+
+# Dependency; GET/HEAD read from the read-only pool. An AsyncSession only checks out a
+# connection on its first query, and is closed after the response has been sent
+async def get_db(request: Request):
+    factory = AsyncReadSessionLocal if request.method in ("GET", "HEAD") else AsyncSessionLocal
+    async with factory() as db:
+        yield db
+
+@app.post("/users/", response_model=schemas.User)
+async def create_user(user: schemas.UserCreate, db: AsyncSession = Depends(get_db)):
+    try:
+        return await crud.create_user(db=db, user=user)
+    except IntegrityError:
+        await db.rollback()
+        raise HTTPException(status_code=400, detail="Email already registered")
+
+@app.get("/users/", response_model=List[schemas.User])
+async def read_users(
+    response: Response,
+    skip: int = 0,
+    limit: int = 100,
+    after_id: Optional[int] = None,
+    cursor: Optional[str] = None,
+    db: AsyncSession = Depends(get_db),
+):
+    if cursor is not None:
+        after_id = decode_cursor(cursor)
+    users = await crud.get_users(db, skip=skip, limit=limit, after_id=after_id)
+    set_next_cursor(response, users, limit)
+    return users
+
+@app.get("/users/export")
+async def export_users(
+    format: str = Query("ndjson", regex="^(ndjson|csv)$"),
+    gzip: bool = False,
+    db: AsyncSession = Depends(get_db),
+):
+    fields = ["id", "email", "is_active"]
+    return export_response("users", fields, crud.stream_users(db), format=format, gzip=gzip)
+
+@app.get("/users/{user_id}", response_model=schemas.User)
+async def read_user(user_id: int, db: AsyncSession = Depends(get_db)):
+    db_user = await crud.get_user_cached(db, user_id=user_id)
+    if db_user is None:
+        raise HTTPException(status_code=404, detail="User not found")
+    return db_user
+
+@app.post("/users/{user_id}/items/", response_model=schemas.Item)
+async def create_item_for_user(
+    user_id: int, item: schemas.ItemCreate, db: AsyncSession = Depends(get_db)
+):
+    return await crud.create_user_item(db=db, item=item, user_id=user_id)
+
+@app.post("/users/{user_id}/items/bulk", response_model=schemas.ItemBulkResult)
+async def create_items_for_user(
+    user_id: int, items: List[schemas.ItemCreate], db: AsyncSession = Depends(get_db)
+):
+    return {"ids": await crud.create_user_items(db=db, items=items, user_id=user_id)}
+
+@app.post("/users/{user_id}/items/bulk.ndjson", response_model=schemas.ItemBulkResult)
+async def stream_items_for_user(
+    user_id: int, request: Request, db: AsyncSession = Depends(get_db)
+):
+    with await spool_ndjson(request.stream(), schemas.ItemCreate) as spool:
+        ids = await crud.create_user_items(db, read_spool(spool, schemas.ItemCreate), user_id)
+    return {"ids": ids}
+
+@app.get("/items/export")
+async def export_items(
+    format: str = Query("ndjson", regex="^(ndjson|csv)$"),
+    gzip: bool = False,
+    db: AsyncSession = Depends(get_db),
+):
+    fields = ["id", "title", "description", "owner_id"]
+    return export_response("items", fields, crud.stream_items(db), format=format, gzip=gzip)
+
+@app.get("/items/search", response_model=List[schemas.Item])
+async def search_items(
+    response: Response,
+    q: str = Query(..., min_length=1),
+    limit: int = 100,
+    cursor: Optional[str] = None,
+    db: AsyncSession = Depends(get_db),
+):
+    rows = await crud.search_items(db, q=q, limit=limit, after=decode_rank_cursor(cursor))
+    if rows and len(rows) == limit:
+        item, rank = rows[-1]
+        response.headers["X-Next-Cursor"] = encode_rank_cursor(rank, item.id)
+    return [item for item, rank in rows]
+
+@app.get("/items/", response_model=List[schemas.Item])
+async def read_items(
+    response: Response,
+    skip: int = 0,
+    limit: int = 100,
+    after_id: Optional[int] = None,
+    cursor: Optional[str] = None,
+    db: AsyncSession = Depends(get_db),
+):
+    if cursor is not None:
+        after_id = decode_cursor(cursor)
+    items = await crud.get_items(db, skip=skip, limit=limit, after_id=after_id)
+    set_next_cursor(response, items, limit)
+    return items
+
+@app.get("/cache/stats")
+def read_cache_stats():
+    return sync_crud.user_cache.stats()
+
+@app.get("/metrics/queries")
+def read_query_metrics():
+    return query_metrics
+
+@app.get("/health/ready")
+def read_readiness(response: Response):
+    if not schema_ready():
+        response.status_code = status.HTTP_503_SERVICE_UNAVAILABLE
+        return {"ready": False}
+    return {"ready": True}
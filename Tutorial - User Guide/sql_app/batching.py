@@ -0,0 +1,70 @@
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+class WriteBatcher:
+    # Group commit: concurrent writers hand their insert to one thread, which runs everything that
+    # arrives within `window` seconds in a single transaction and resolves each caller with its own row
+    def __init__(self, session_factory, window: float = 0.005, max_batch: int = 500):
+        self.session_factory = session_factory
+        self.window = window
+        self.max_batch = max_batch
+        self.queue = queue.Queue()
+        self.thread = threading.Thread(target=self._run, name="write-batcher", daemon=True)
+        self.thread.start()
+
+    def submit(self, op, *args):
+        # op(db, *args) must not commit; blocks until the batch holding it is committed
+        future = Future()
+        self.queue.put((op, args, future))
+        return future.result()
+
+    def close(self):
+        self.queue.put(None)
+        self.thread.join()
+
+    def _run(self):
+        while True:
+            entry = self.queue.get()
+            if entry is None:
+                return
+            batch = [entry]
+            deadline = time.monotonic() + self.window
+            while len(batch) < self.max_batch:
+                timeout = deadline - time.monotonic()
+                if timeout <= 0:
+                    break
+                try:
+                    entry = self.queue.get(timeout=timeout)
+                except queue.Empty:
+                    break
+                if entry is None:
+                    self._flush(batch)
+                    return
+                batch.append(entry)
+            self._flush(batch)
+
+    def _flush(self, batch):
+        db = self.session_factory()
+        try:
+            try:
+                results = [op(db, *args) for op, args, future in batch]
+                db.commit()
+            except Exception:
+                db.rollback()
+                # One bad row (e.g. a duplicate email) must not fail its neighbours, redo them one by one
+                for op, args, future in batch:
+                    try:
+                        result = op(db, *args)
+                        db.commit()
+                    except Exception as e:
+                        db.rollback()
+                        future.set_exception(e)
+                    else:
+                        future.set_result(result)
+                return
+            for (op, args, future), result in zip(batch, results):
+                future.set_result(result)
+        finally:
+            db.close()
@@ -1,29 +1,151 @@
-from sqlalchemy.orm import Session
+from itertools import islice
+from typing import Iterable, List, Optional, Tuple
+from sqlalchemy import and_, insert, or_, select, text
+from sqlalchemy.orm import Session, joinedload, selectinload
+from sqlalchemy.orm.attributes import set_committed_value
 from . import models, schemas
+from .batching import WriteBatcher
+from .cache import Cache, TTLCache
+from .search import items_fts, match_query
+
+# Caches the serialized schemas.User, ORM instances are bound to the session that loaded them
+user_cache: Cache = TTLCache(maxsize=10000, ttl=60)
+
+# Set to a WriteBatcher to group-commit create_user / create_user_item across concurrent requests
+write_batcher: Optional[WriteBatcher] = None
 
 def get_user(db: Session, user_id: int):
-    return db.query(models.User).filter(models.User.id == user_id).first()
+    # One row, so pull its items in the same round trip
+    return (
+        db.query(models.User)
+        .options(joinedload(models.User.items))
+        .filter(models.User.id == user_id)
+        .first()
+    )
 
 def get_user_by_email(db: Session, email: str):
     return db.query(models.User).filter(models.User.email == email).first()
 
-def get_users(db: Session, skip: int = 0, limit: int = 100):
-    return db.query(models.User).offset(skip).limit(limit).all()
+def get_user_cached(db: Session, user_id: int) -> Optional[schemas.User]:
+    key = f"user:{user_id}"
+    user = user_cache.get(key)
+    if user is None:
+        db_user = get_user(db, user_id=user_id)
+        if db_user is None:
+            return None
+        user = schemas.User.from_orm(db_user)
+        user_cache.set(key, user)
+    return user
 
-def create_user(db: Session, user: schemas.UserCreate):
+def get_users(db: Session, skip: int = 0, limit: int = 100, after_id: Optional[int] = None):
+    # A page of users gets its items from a single extra IN (...) query
+    query = (
+        db.query(models.User)
+        .options(selectinload(models.User.items))
+        .order_by(models.User.id)
+    )
+    if after_id is not None:
+        # Seek on the primary key index instead of scanning `skip` rows
+        return query.filter(models.User.id > after_id).limit(limit).all()
+    return query.offset(skip).limit(limit).all()
+
+def insert_user(db: Session, user: schemas.UserCreate) -> schemas.User:
+    # One INSERT ... RETURNING; a duplicate email raises IntegrityError from the unique index
     fake_hashed_password = user.password + "notreallyhashed"
-    db_user = models.User(email=user.email, hashed_password=fake_hashed_password)
-    db.add(db_user)
-    db.commit()
-    db.refresh(db_user)
-    return db_user
-
-def get_items(db: Session, skip: int = 0, limit: int = 100):
-    return db.query(models.Item).offset(skip).limit(limit).all()
-
-def create_user_item(db: Session, item: schemas.ItemCreate, user_id: int):
-    db_item = models.Item(**item.dict(), owner_id=user_id)
-    db.add(db_item)
-    db.commit()
-    db.refresh(db_item)
-    return db_item
\ No newline at end of file
+    stmt = insert(models.User).returning(models.User)
+    db_user = db.scalars(stmt, [{"email": user.email, "hashed_password": fake_hashed_password}]).one()
+    set_committed_value(db_user, "items", [])
+    # Serialize before commit expires the instance, otherwise reading it back costs a SELECT
+    return schemas.User.from_orm(db_user)
+
+def create_user(db: Session, user: schemas.UserCreate) -> schemas.User:
+    if write_batcher is not None:
+        new_user = write_batcher.submit(insert_user, user)
+    else:
+        new_user = insert_user(db, user)
+        db.commit()
+    return new_user
+
+def get_items(db: Session, skip: int = 0, limit: int = 100, after_id: Optional[int] = None):
+    query = db.query(models.Item).order_by(models.Item.id)
+    if after_id is not None:
+        return query.filter(models.Item.id > after_id).limit(limit).all()
+    return query.offset(skip).limit(limit).all()
+
+def search_items_query(q: str, limit: int = 100, after: Optional[Tuple[float, int]] = None):
+    # Best bm25 rank first, (rank, id) is the keyset for the next page
+    match = match_query(q)
+    if not match:
+        # Only whitespace: no terms to match, and an empty MATCH is an FTS5 syntax error
+        return None
+    query = (
+        select(models.Item, items_fts.c.rank)
+        .join(items_fts, items_fts.c.rowid == models.Item.id)
+        .where(text("items_fts MATCH :q").bindparams(q=match))
+        .order_by(items_fts.c.rank, models.Item.id)
+        .limit(limit)
+    )
+    if after is not None:
+        rank, last_id = after
+        query = query.where(
+            or_(items_fts.c.rank > rank, and_(items_fts.c.rank == rank, models.Item.id > last_id))
+        )
+    return query
+
+def search_items(db: Session, q: str, limit: int = 100, after: Optional[Tuple[float, int]] = None):
+    query = search_items_query(q, limit=limit, after=after)
+    if query is None:
+        return []
+    return db.execute(query).all()
+
+def insert_user_item(db: Session, item: schemas.ItemCreate, user_id: int) -> schemas.Item:
+    stmt = insert(models.Item).returning(models.Item)
+    db_item = db.scalars(stmt, [dict(item.dict(), owner_id=user_id)]).one()
+    return schemas.Item.from_orm(db_item)
+
+def create_user_item(db: Session, item: schemas.ItemCreate, user_id: int) -> schemas.Item:
+    if write_batcher is not None:
+        new_item = write_batcher.submit(insert_user_item, item, user_id)
+    else:
+        new_item = insert_user_item(db, item, user_id)
+        db.commit()
+    user_cache.delete(f"user:{user_id}")
+    return new_item
+
+def insert_user_items(db: Session, items: Iterable[schemas.ItemCreate], user_id: int, chunk_size: int = 1000) -> List[int]:
+    # executemany per chunk, ids come back via RETURNING so nothing is refreshed; caller commits
+    stmt = insert(models.Item).returning(models.Item.id)
+    items = iter(items)
+    ids = []
+    while True:
+        chunk = [dict(item.dict(), owner_id=user_id) for item in islice(items, chunk_size)]
+        if not chunk:
+            return ids
+        # Each batch gets ascending ids in VALUES order, sorting is cheaper than a sentinel column
+        ids.extend(sorted(db.scalars(stmt, chunk)))
+
+def create_user_items(db: Session, items: Iterable[schemas.ItemCreate], user_id: int) -> List[int]:
+    try:
+        ids = insert_user_items(db, items, user_id)
+        db.commit()
+    except Exception:
+        db.rollback()
+        raise
+    user_cache.delete(f"user:{user_id}")
+    return ids
+
+USER_EXPORT_COLUMNS = [models.User.id, models.User.email, models.User.is_active]
+ITEM_EXPORT_COLUMNS = [models.Item.id, models.Item.title, models.Item.description, models.Item.owner_id]
+
+def stream_query(columns, batch_size: int = 1000):
+    # Plain column tuples (no identity map), fetched batch by batch from one cursor
+    return select(*columns).order_by(columns[0]).execution_options(yield_per=batch_size)
+
+def stream_rows(db: Session, columns, batch_size: int = 1000):
+    yield from db.execute(stream_query(columns, batch_size)).partitions()
+
+def stream_users(db: Session, batch_size: int = 1000):
+    return stream_rows(db, USER_EXPORT_COLUMNS, batch_size)
+
+def stream_items(db: Session, batch_size: int = 1000):
+    return stream_rows(db, ITEM_EXPORT_COLUMNS, batch_size)
@@ -0,0 +1,73 @@
+import csv
+import io
+import json
+import zlib
+from starlette.responses import StreamingResponse
+
+MEDIA_TYPES = {"ndjson": "application/x-ndjson", "csv": "text/csv"}
+
+class ChunkEncoder:
+    # Turns one partition of rows at a time into response bytes, so the sync and async
+    # exports share the formatting and only differ in how they iterate partitions
+    def __init__(self, fields, format: str = "ndjson", gzip: bool = False):
+        self.fields = fields
+        self.format = format
+        self.header_sent = False
+        self.buffer = io.StringIO()
+        self.writer = csv.writer(self.buffer)
+        self.compressor = zlib.compressobj(wbits=31) if gzip else None  # gzip container
+
+    def csv_text(self, rows) -> str:
+        if not self.header_sent:
+            self.writer.writerow(self.fields)
+            self.header_sent = True
+        self.writer.writerows(rows)
+        text = self.buffer.getvalue()
+        self.buffer.seek(0)
+        self.buffer.truncate()
+        return text
+
+    def encode(self, rows) -> bytes:
+        if self.format == "ndjson":
+            data = "".join(json.dumps(dict(zip(self.fields, row))) + "\n" for row in rows).encode()
+        else:
+            data = self.csv_text(rows).encode()
+        return self.compressor.compress(data) if self.compressor else data
+
+    def finish(self) -> bytes:
+        # An empty CSV export still gets its header line
+        data = self.csv_text([]).encode() if self.format == "csv" and not self.header_sent else b""
+        if self.compressor:
+            return self.compressor.compress(data) + self.compressor.flush()
+        return data
+
+def iter_chunks(encoder: ChunkEncoder, partitions):
+    for rows in partitions:
+        data = encoder.encode(rows)
+        if data:
+            yield data
+    data = encoder.finish()
+    if data:
+        yield data
+
+async def aiter_chunks(encoder: ChunkEncoder, partitions):
+    async for rows in partitions:
+        data = encoder.encode(rows)
+        if data:
+            yield data
+    data = encoder.finish()
+    if data:
+        yield data
+
+def export_response(name: str, fields, partitions, format: str = "ndjson", gzip: bool = False):
+    # One partition (yield_per batch) is in memory at a time, whatever the table size.
+    # partitions may be a plain or an async iterable (AsyncResult.partitions())
+    encoder = ChunkEncoder(fields, format=format, gzip=gzip)
+    if hasattr(partitions, "__aiter__"):
+        chunks = aiter_chunks(encoder, partitions)
+    else:
+        chunks = iter_chunks(encoder, partitions)
+    headers = {"Content-Disposition": f'attachment; filename="{name}.{format}"'}
+    if gzip:
+        headers["Content-Encoding"] = "gzip"
+    return StreamingResponse(chunks, media_type=MEDIA_TYPES[format], headers=headers)
@@ -0,0 +1,27 @@
+# Schema setup, run once per deploy with `python -m sql_app.init_db` instead of at import time
+from sqlalchemy import inspect
+from sqlalchemy.exc import OperationalError
+from . import models
+from .database import engine, read_engine
+from .search import create_search_index
+
+def required_tables():
+    tables = set(models.Base.metadata.tables)
+    if engine.dialect.name == "sqlite":
+        tables.add("items_fts")
+    return tables
+
+def schema_ready() -> bool:
+    # A single catalog query on the read pool, cheap enough for a readiness probe
+    try:
+        return required_tables() <= set(inspect(read_engine).get_table_names())
+    except OperationalError:
+        return False
+
+def init_db():
+    models.Base.metadata.create_all(bind=engine)
+    create_search_index(engine)
+
+if __name__ == "__main__":
+    init_db()
+    print("schema ready" if schema_ready() else "schema incomplete")
@@ -0,0 +1,100 @@
+import logging
+import re
+import time
+from collections import Counter
+from contextvars import ContextVar
+from typing import Optional
+from sqlalchemy import event
+
+logger = logging.getLogger(__name__)
+
+# Log when one statement shape runs more than this many times in a single request
+N_PLUS_ONE_THRESHOLD = 10
+
+IN_LIST = re.compile(r"\(\s*\?(?:\s*,\s*\?)*\s*\)")
+
+class QueryStats:
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.slowest = 0.0
+        self.slowest_statement = None
+        self.shapes = Counter()
+
+    def record(self, statement: str, elapsed: float):
+        self.count += 1
+        self.total += elapsed
+        if elapsed > self.slowest:
+            self.slowest = elapsed
+            self.slowest_statement = statement
+        # Expanded IN (?, ?, ...) lists vary in length, collapse them so they count as one shape
+        shape = IN_LIST.sub("(?)", statement)
+        self.shapes[shape] += 1
+        if self.shapes[shape] == N_PLUS_ONE_THRESHOLD + 1:
+            logger.warning("Possible N+1: statement repeated over %d times in one request: %s", N_PLUS_ONE_THRESHOLD, shape)
+
+    def server_timing(self) -> str:
+        return (
+            f'db;dur={self.total * 1000:.2f};desc="{self.count} queries", '
+            f"db-slowest;dur={self.slowest * 1000:.2f}"
+        )
+
+query_stats: ContextVar[Optional[QueryStats]] = ContextVar("query_stats", default=None)
+
+# Totals per endpoint name, served by the metrics endpoint
+query_metrics = {}
+
+def instrument(engine):
+    @event.listens_for(engine, "before_cursor_execute")
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("query_start", []).append(time.perf_counter())
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        elapsed = time.perf_counter() - conn.info["query_start"].pop()
+        stats = query_stats.get()
+        if stats is not None:
+            stats.record(statement, elapsed)
+
+    @event.listens_for(engine, "handle_error")
+    def handle_error(exception_context):
+        # A statement that raised never reaches after_cursor_execute; drop its start time so
+        # the pooled connection's list doesn't grow with every failed query
+        conn = exception_context.connection
+        if conn is not None and conn.info.get("query_start"):
+            conn.info["query_start"].pop()
+
+def record_metrics(name: str, stats: QueryStats):
+    metrics = query_metrics.setdefault(
+        name,
+        {"requests": 0, "queries": 0, "max_queries": 0, "db_time_ms": 0.0, "slowest_ms": 0.0, "slowest_statement": None},
+    )
+    metrics["requests"] += 1
+    metrics["queries"] += stats.count
+    metrics["max_queries"] = max(metrics["max_queries"], stats.count)
+    metrics["db_time_ms"] += stats.total * 1000
+    if stats.slowest * 1000 > metrics["slowest_ms"]:
+        metrics["slowest_ms"] = stats.slowest * 1000
+        metrics["slowest_statement"] = stats.slowest_statement
+
+class QueryStatsMiddleware:
+    def __init__(self, app):
+        self.app = app
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        stats = QueryStats()
+        token = query_stats.set(stats)
+
+        async def send_with_timing(message):
+            # Covers the queries run before the headers go out, i.e. all of them unless the body is streamed
+            if message["type"] == "http.response.start":
+                message.setdefault("headers", []).append((b"server-timing", stats.server_timing().encode()))
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_timing)
+        finally:
+            query_stats.reset(token)
+            endpoint = scope.get("endpoint")
+            record_metrics(getattr(endpoint, "__name__", "unmatched"), stats)
@@ -1,47 +1,79 @@
-from typing import List
-from fastapi import Depends, FastAPI, HTTPException, Request, Response
+import os
+from typing import List, Optional
+from fastapi import Depends, FastAPI, HTTPException, Query, Request, Response, status
+from fastapi.concurrency import run_in_threadpool
+from sqlalchemy.exc import IntegrityError
 from sqlalchemy.orm import Session
-from . import crud, models, schemas
-from .database import SessionLocal, engine
-from starlette.responses import StreamingResponse
-
-models.Base.metadata.create_all(bind=engine)
+from . import crud, schemas
+from .batching import WriteBatcher
+from .database import DBSessionMiddleware, SessionLocal
+from .export import export_response
+from .init_db import init_db, schema_ready
+from .instrumentation import QueryStatsMiddleware, query_metrics
+from .ndjson import read_spool, spool_ndjson
+from .pagination import decode_cursor, decode_rank_cursor, encode_rank_cursor, set_next_cursor
 
 app = FastAPI()
 
-@app.middleware("http")
-async def db_session_middleware(request: Request, call_next):
-    response = Response("Internal server error", status_code=500)
-    try:
-        request.state.db = SessionLocal()
-        response = await call_next(request)
-    finally:
-        request.state.db.close()    
-    return response
-
-# Dependency
-def get_db():
-    db = SessionLocal()
-    try:
-        yield db
-    finally:
-        db.close()
+app.add_middleware(DBSessionMiddleware)
+app.add_middleware(QueryStatsMiddleware)
+
+@app.on_event("startup")
+def create_schema():
+    # No DDL on the import path; workers only touch the schema if the init step hasn't run yet
+    if not schema_ready():
+        init_db()
+
+@app.on_event("startup")
+def start_write_batcher():
+    if os.getenv("SQL_APP_WRITE_BATCHING") == "1":
+        crud.write_batcher = WriteBatcher(SessionLocal)
+
+@app.on_event("shutdown")
+def flush_write_batcher():
+    if crud.write_batcher is not None:
+        crud.write_batcher.close()
+        crud.write_batcher = None
+
+# Dependency, shares the request's session with request.state.db
+def get_db(request: Request):
+    return request.state.db.get()
 
 @app.post("/users/", response_model=schemas.User)
 def create_user(user: schemas.UserCreate, db: Session = Depends(get_db)):
-    db_user = crud.get_user_by_email(db, email=user.email)
-    if db_user:
+    try:
+        return crud.create_user(db=db, user=user)
+    except IntegrityError:
+        db.rollback()
         raise HTTPException(status_code=400, detail="Email already registered")
-    return crud.create_user(db=db, user=user)
 
 @app.get("/users/", response_model=List[schemas.User])
-def read_users(skip: int = 0, limit: int = 100, db: Session = Depends(get_db)):
-    users = crud.get_users(db, skip=skip, limit=limit)
+def read_users(
+    response: Response,
+    skip: int = 0,
+    limit: int = 100,
+    after_id: Optional[int] = None,
+    cursor: Optional[str] = None,
+    db: Session = Depends(get_db),
+):
+    if cursor is not None:
+        after_id = decode_cursor(cursor)
+    users = crud.get_users(db, skip=skip, limit=limit, after_id=after_id)
+    set_next_cursor(response, users, limit)
     return users
 
+@app.get("/users/export")
+def export_users(
+    format: str = Query("ndjson", regex="^(ndjson|csv)$"),
+    gzip: bool = False,
+    db: Session = Depends(get_db),
+):
+    fields = ["id", "email", "is_active"]
+    return export_response("users", fields, crud.stream_users(db), format=format, gzip=gzip)
+
 @app.get("/users/{user_id}", response_model=schemas.User)
 def read_user(user_id: int, db: Session = Depends(get_db)):
-    db_user = crud.get_user(db, user_id=user_id)
+    db_user = crud.get_user_cached(db, user_id=user_id)
     if db_user is None:
         raise HTTPException(status_code=404, detail="User not found")
     return db_user
@@ -52,7 +84,76 @@ def create_item_for_user(
 ):
     return crud.create_user_item(db=db, item=item, user_id=user_id)
 
+@app.post("/users/{user_id}/items/bulk", response_model=schemas.ItemBulkResult)
+def create_items_for_user(
+    user_id: int, items: List[schemas.ItemCreate], db: Session = Depends(get_db)
+):
+    return {"ids": crud.create_user_items(db=db, items=items, user_id=user_id)}
+
+@app.post("/users/{user_id}/items/bulk.ndjson", response_model=schemas.ItemBulkResult)
+async def stream_items_for_user(
+    user_id: int, request: Request, db: Session = Depends(get_db)
+):
+    # One ItemCreate per line; the body is spooled and validated first, then inserted in one short transaction
+    with await spool_ndjson(request.stream(), schemas.ItemCreate) as spool:
+        items = read_spool(spool, schemas.ItemCreate)
+        ids = await run_in_threadpool(crud.create_user_items, db, items, user_id)
+    return {"ids": ids}
+
+@app.get("/items/export")
+def export_items(
+    format: str = Query("ndjson", regex="^(ndjson|csv)$"),
+    gzip: bool = False,
+    db: Session = Depends(get_db),
+):
+    fields = ["id", "title", "description", "owner_id"]
+    return export_response("items", fields, crud.stream_items(db), format=format, gzip=gzip)
+
+@app.get("/items/search", response_model=List[schemas.Item])
+def search_items(
+    response: Response,
+    q: str = Query(..., min_length=1),
+    limit: int = 100,
+    cursor: Optional[str] = None,
+    db: Session = Depends(get_db),
+):
+    rows = crud.search_items(db, q=q, limit=limit, after=decode_rank_cursor(cursor))
+    if rows and len(rows) == limit:
+        item, rank = rows[-1]
+        response.headers["X-Next-Cursor"] = encode_rank_cursor(rank, item.id)
+    return [item for item, rank in rows]
+
 @app.get("/items/", response_model=List[schemas.Item])
-def read_items(skip: int = 0, limit: int = 100, db: Session = Depends(get_db)):
-    items = crud.get_items(db, skip=skip, limit=limit)
-    return items
\ No newline at end of file
+def read_items(
+    response: Response,
+    skip: int = 0,
+    limit: int = 100,
+    after_id: Optional[int] = None,
+    cursor: Optional[str] = None,
+    db: Session = Depends(get_db),
+):
+    if cursor is not None:
+        after_id = decode_cursor(cursor)
+    items = crud.get_items(db, skip=skip, limit=limit, after_id=after_id)
+    set_next_cursor(response, items, limit)
+    return items
+
+@app.get("/cache/stats")
+def read_cache_stats():
+    return crud.user_cache.stats()
+
+@app.get("/metrics/queries")
+def read_query_metrics():
+    return query_metrics
+
+@app.get("/health/ready")
+def read_readiness(response: Response):
+    if not schema_ready():
+        response.status_code = status.HTTP_503_SERVICE_UNAVAILABLE
+        return {"ready": False}
+    return {"ready": True}
+
+# SQL_APP_ASYNC=1 serves the same API through AsyncSession (async_main.py) from this same
+# ASGI target, so switching modes is a config change rather than a different entry point
+if os.getenv("SQL_APP_ASYNC") == "1":
+    from .async_main import app
@@ -0,0 +1,46 @@
+import json
+import tempfile
+from typing import AsyncIterable, Iterator, Type
+from fastapi import HTTPException, status
+from pydantic import BaseModel, ValidationError
+
+MAX_NDJSON_BYTES = 64 * 1024 * 1024
+SPOOL_MEMORY_BYTES = 1024 * 1024
+
+def spool_line(spool, model: Type[BaseModel], line: bytes):
+    if line.strip():
+        spool.write(model(**json.loads(line)).json().encode() + b"\n")
+
+async def spool_ndjson(stream: AsyncIterable[bytes], model: Type[BaseModel], max_bytes: int = MAX_NDJSON_BYTES):
+    # The whole body is read and validated before any DB work, so a slow client never holds a
+    # transaction (or the writer connection) open. Validated rows go to a temp spool that stays in
+    # memory up to SPOOL_MEMORY_BYTES and then moves to disk; the caller closes it
+    spool = tempfile.SpooledTemporaryFile(max_size=SPOOL_MEMORY_BYTES)
+    size = 0
+    buffer = b""
+    try:
+        async for data in stream:
+            size += len(data)
+            if size > max_bytes:
+                raise HTTPException(
+                    status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+                    detail=f"NDJSON body is over {max_bytes} bytes",
+                )
+            lines = (buffer + data).split(b"\n")
+            buffer = lines.pop()
+            for line in lines:
+                spool_line(spool, model, line)
+        spool_line(spool, model, buffer)
+    except (ValueError, TypeError, ValidationError) as e:
+        spool.close()
+        raise HTTPException(status_code=422, detail=f"Invalid NDJSON item: {e}")
+    except BaseException:
+        spool.close()
+        raise
+    spool.seek(0)
+    return spool
+
+def read_spool(spool, model: Type[BaseModel]) -> Iterator[BaseModel]:
+    # Rows were validated on the way in, construct() skips validating them again
+    for line in spool:
+        yield model.construct(**json.loads(line))
@@ -0,0 +1,31 @@
+import base64
+from typing import Optional, Tuple
+from fastapi import HTTPException
+
+def encode_cursor(last_id: int) -> str:
+    return base64.urlsafe_b64encode(str(last_id).encode()).decode()
+
+def decode_cursor(cursor: Optional[str]) -> Optional[int]:
+    if cursor is None:
+        return None
+    try:
+        return int(base64.urlsafe_b64decode(cursor.encode()).decode())
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+def encode_rank_cursor(rank: float, last_id: int) -> str:
+    return base64.urlsafe_b64encode(f"{rank!r}:{last_id}".encode()).decode()
+
+def decode_rank_cursor(cursor: Optional[str]) -> Optional[Tuple[float, int]]:
+    if cursor is None:
+        return None
+    try:
+        rank, last_id = base64.urlsafe_b64decode(cursor.encode()).decode().split(":")
+        return float(rank), int(last_id)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+def set_next_cursor(response, rows, limit: int):
+    # A short page means there is nothing left to seek past
+    if rows and len(rows) == limit:
+        response.headers["X-Next-Cursor"] = encode_cursor(rows[-1].id)
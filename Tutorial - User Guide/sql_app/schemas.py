@@ -14,6 +14,9 @@ class Item(ItemBase):
     class Config:
         orm_mode = True
 
+class ItemBulkResult(BaseModel):
+    ids: List[int]
+
 class UserBase(BaseModel):
     email: str
 
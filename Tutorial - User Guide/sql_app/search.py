@@ -0,0 +1,39 @@
+from sqlalchemy import column, table, text
+
+# External-content FTS5 index over items(title, description); triggers keep it in step with every
+# write path, including the executemany bulk inserts
+items_fts = table("items_fts", column("rowid"), column("rank"))
+
+FTS_DDL = [
+    """CREATE VIRTUAL TABLE IF NOT EXISTS items_fts
+       USING fts5(title, description, content='items', content_rowid='id')""",
+    """CREATE TRIGGER IF NOT EXISTS items_fts_ai AFTER INSERT ON items BEGIN
+         INSERT INTO items_fts(rowid, title, description) VALUES (new.id, new.title, new.description);
+       END""",
+    """CREATE TRIGGER IF NOT EXISTS items_fts_ad AFTER DELETE ON items BEGIN
+         INSERT INTO items_fts(items_fts, rowid, title, description)
+         VALUES ('delete', old.id, old.title, old.description);
+       END""",
+    """CREATE TRIGGER IF NOT EXISTS items_fts_au AFTER UPDATE ON items BEGIN
+         INSERT INTO items_fts(items_fts, rowid, title, description)
+         VALUES ('delete', old.id, old.title, old.description);
+         INSERT INTO items_fts(rowid, title, description) VALUES (new.id, new.title, new.description);
+       END""",
+]
+
+def create_search_index(engine):
+    if engine.dialect.name != "sqlite":
+        return
+    with engine.begin() as conn:
+        exists = conn.execute(
+            text("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'items_fts'")
+        ).first()
+        for ddl in FTS_DDL:
+            conn.execute(text(ddl))
+        if not exists:
+            # Index rows that were written before the triggers existed
+            conn.execute(text("INSERT INTO items_fts(items_fts) VALUES ('rebuild')"))
+
+def match_query(q: str) -> str:
+    # Every whitespace-separated term as a quoted string, so user input can't inject FTS5 syntax
+    return " ".join('"' + term.replace('"', '""') + '"' for term in q.split())
@@ -0,0 +1,226 @@
+# Side-by-side benchmark of the SQLAlchemy and peewee sql_app implementations
+# Usage: python benchmarks/compare_sql_apps.py --sizes 100,1000 --requests 500 --concurrency 16 --output bench.json
+#
+# Each (app, dataset size) runs in its own interpreter and temp directory: both packages are called
+# `sql_app`, and every run starts from an identical freshly seeded database.
+import argparse
+import asyncio
+import contextlib
+import functools
+import json
+import logging
+import os
+import platform
+import random
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+APPS = {
+    "sqlalchemy": os.path.join(ROOT, "Tutorial - User Guide"),
+    "peewee": os.path.join(ROOT, "Advanced User Guide", "sql-relational-databases-with-peewee"),
+    # Same app with its user TTLCache on; reported on its own, the peewee app has no cache to compare with
+    "sqlalchemy-cached": os.path.join(ROOT, "Tutorial - User Guide"),
+}
+DEFAULT_APPS = "sqlalchemy,peewee"
+
+ITEMS_PER_USER = 5
+
+def dataset(size: int):
+    # `size` users with ITEMS_PER_USER items each, the same rows for both stacks
+    users = [{"email": f"user{i}@example.com", "hashed_password": "notreallyhashed"} for i in range(size)]
+    items = [
+        {"title": f"item {i}-{j}", "description": f"description for item {i}-{j}", "owner_id": i + 1}
+        for i in range(size)
+        for j in range(ITEMS_PER_USER)
+    ]
+    return users, items
+
+def endpoints(size: int, seed: int = 0):
+    rng = random.Random(seed)
+    return {
+        "GET /users/": lambda: ("GET", "/users/?limit=100", None),
+        "GET /users/{id}": lambda: ("GET", f"/users/{rng.randint(1, size)}", None),
+        "GET /items/": lambda: ("GET", "/items/?limit=100", None),
+        "POST /users/{id}/items/": lambda: (
+            "POST", f"/users/{rng.randint(1, size)}/items/", {"title": "bench", "description": "bench"},
+        ),
+    }
+
+def setup_sqlalchemy(users, items, cached: bool = False):
+    from sqlalchemy import insert
+    from sql_app import crud, models
+    from sql_app.cache import Cache
+    from sql_app.database import count_queries, engine
+    from sql_app.init_db import init_db
+    from sql_app.main import app
+
+    class NullCache(Cache):
+        def get(self, key):
+            return None
+        def set(self, key, value):
+            pass
+        def delete(self, key):
+            pass
+
+    if not cached:
+        # Every lookup goes to the database, like the peewee app, so the numbers compare the stacks
+        crud.user_cache = NullCache()
+    init_db()
+    with engine.begin() as conn:
+        conn.execute(insert(models.User), users)
+        conn.execute(insert(models.Item), items)
+    return app, count_queries
+
+def setup_peewee(users, items):
+    from sql_app import database, models
+    from sql_app.init_db import init_db
+    from sql_app.main import app
+
+    init_db()
+    # New dicts, the shared `items` rows keep their owner_id
+    rows = [
+        dict({key: value for key, value in item.items() if key != "owner_id"}, owner=item["owner_id"])
+        for item in items
+    ]
+    with database.db.connection_context():
+        with database.db.atomic():
+            for start in range(0, len(users), 500):
+                models.User.insert_many(users[start:start + 500]).execute()
+            for start in range(0, len(rows), 500):
+                models.Item.insert_many(rows[start:start + 500]).execute()
+
+    @contextlib.contextmanager
+    def count_queries():
+        # peewee logs every statement as a (sql, params) tuple on its debug logger
+        counter = {"count": 0}
+        class Handler(logging.Handler):
+            def emit(self, record):
+                if isinstance(record.msg, tuple):
+                    counter["count"] += 1
+        handler = Handler()
+        logger = logging.getLogger("peewee")
+        level = logger.level
+        logger.addHandler(handler)
+        logger.setLevel(logging.DEBUG)
+        try:
+            yield counter
+        finally:
+            logger.removeHandler(handler)
+            logger.setLevel(level)
+
+    return app, count_queries
+
+SETUP = {
+    "sqlalchemy": setup_sqlalchemy,
+    "peewee": setup_peewee,
+    "sqlalchemy-cached": functools.partial(setup_sqlalchemy, cached=True),
+}
+
+async def drive(client, make_request, requests: int, concurrency: int):
+    latencies = []
+    errors = 0
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def one():
+        nonlocal errors
+        method, url, body = make_request()
+        async with semaphore:
+            start = time.perf_counter()
+            response = await client.request(method, url, json=body)
+            latencies.append(time.perf_counter() - start)
+            if response.status_code >= 400:
+                errors += 1
+
+    start = time.perf_counter()
+    await asyncio.gather(*(one() for _ in range(requests)))
+    elapsed = time.perf_counter() - start
+    latencies.sort()
+    return {
+        "requests": requests,
+        "errors": errors,
+        "throughput_rps": requests / elapsed,
+        "p50_ms": statistics.median(latencies) * 1000,
+        "p99_ms": latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))] * 1000,
+    }
+
+async def run_worker(app_name: str, size: int, requests: int, concurrency: int):
+    import httpx
+
+    users, items = dataset(size)
+    app, count_queries = SETUP[app_name](users, items)
+    await app.router.startup()
+    results = {}
+    try:
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+            for name, make_request in endpoints(size).items():
+                await drive(client, make_request, min(requests, 20), concurrency)  # warm up
+                with count_queries() as counter:
+                    result = await drive(client, make_request, requests, concurrency)
+                result["queries_per_request"] = counter["count"] / requests
+                results[name] = result
+    finally:
+        await app.router.shutdown()
+    return results
+
+def git_commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "HEAD"], cwd=ROOT, capture_output=True, text=True, check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the SQLAlchemy and peewee sql_app variants")
+    parser.add_argument("--sizes", default="100,1000,10000")
+    parser.add_argument("--requests", type=int, default=500)
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--apps", default=DEFAULT_APPS, help=f"comma separated, from: {', '.join(APPS)}")
+    parser.add_argument("--output", default="bench_results.json")
+    parser.add_argument("--worker", nargs=2, metavar=("APP", "SIZE"), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        app_name, size = args.worker
+        sys.path.insert(0, APPS[app_name])
+        results = asyncio.run(run_worker(app_name, int(size), args.requests, args.concurrency))
+        print(json.dumps(results))
+        return
+
+    report = {
+        "commit": git_commit(),
+        "python": platform.python_version(),
+        "requests": args.requests,
+        "concurrency": args.concurrency,
+        "items_per_user": ITEMS_PER_USER,
+        "results": {},
+    }
+    for app_name in args.apps.split(","):
+        for size in args.sizes.split(","):
+            with tempfile.TemporaryDirectory() as workdir:
+                output = subprocess.run(
+                    [
+                        sys.executable, os.path.abspath(__file__), "--worker", app_name, size,
+                        "--requests", str(args.requests), "--concurrency", str(args.concurrency),
+                    ],
+                    cwd=workdir, check=True, capture_output=True, text=True,
+                ).stdout
+            results = json.loads(output.strip().splitlines()[-1])
+            report["results"].setdefault(app_name, {})[size] = results
+            for endpoint, result in results.items():
+                print(
+                    f"{app_name:<17} {size:>6} {endpoint:<24} {result['throughput_rps']:8.1f} req/s"
+                    f"  p50 {result['p50_ms']:7.2f} ms  p99 {result['p99_ms']:7.2f} ms"
+                    f"  {result['queries_per_request']:5.2f} q/req"
+                )
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=2, sort_keys=True)
+
+if __name__ == "__main__":
+    main()
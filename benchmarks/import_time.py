@@ -0,0 +1,40 @@
+# Cold-start cost of each sql_app: a fresh interpreter per run, timing `import sql_app.main`
+# Usage: python benchmarks/import_time.py [runs]
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+APPS = {
+    "sqlalchemy": os.path.join(ROOT, "Tutorial - User Guide"),
+    "peewee": os.path.join(ROOT, "Advanced User Guide", "sql-relational-databases-with-peewee"),
+}
+
+SNIPPET = """
+import sys, time
+sys.path.insert(0, {path!r})
+start = time.perf_counter()
+import sql_app.main
+print(time.perf_counter() - start)
+"""
+
+def measure(path: str, runs: int):
+    timings = []
+    # Run in an empty directory so no database file exists, as on a fresh worker
+    with tempfile.TemporaryDirectory() as workdir:
+        for _ in range(runs):
+            output = subprocess.run(
+                [sys.executable, "-c", SNIPPET.format(path=path)],
+                cwd=workdir, check=True, capture_output=True, text=True,
+            ).stdout
+            timings.append(float(output.strip().splitlines()[-1]))
+    return timings
+
+if __name__ == "__main__":
+    runs = int(sys.argv[1]) if len(sys.argv) > 1 else 5
+    for name, path in APPS.items():
+        timings = measure(path, runs)
+        print(f"{name}: median {statistics.median(timings) * 1000:.1f} ms, min {min(timings) * 1000:.1f} ms over {runs} runs")